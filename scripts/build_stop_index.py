@@ -1,4 +1,6 @@
 import argparse
+from pathlib import Path
+
 from idf_rer.gtfs_stop_index import GtfsStopIndexPaths, build_stop_index
 
 
@@ -9,7 +11,7 @@ def main() -> None:
     ap.add_argument("--out", default="data/derived/stop_index.csv")
     args = ap.parse_args()
 
-    out = build_stop_index(GtfsStopIndexPaths(args.stops, args.stop_extensions, args.out))
+    out = build_stop_index(GtfsStopIndexPaths(Path(args.stops), Path(args.stop_extensions), Path(args.out)))
     print(out)
 
 
@@ -29,6 +29,7 @@ def main() -> None:
     ap.add_argument("--out-dir", default="data/sample/merged", help="Output folder for merged sample.")
     ap.add_argument("--max-unmapped-share", type=float, default=0.40, help="Fail if unmapped stops exceed this share.")
     ap.add_argument("--keep-unmapped-stops", action="store_true", help="Keep unmapped stop rows (do not drop).")
+    ap.add_argument("--format", choices=["csv", "parquet"], default="csv", help="Output file format.")
     args = ap.parse_args()
 
     sample_dir = Path(args.sample_dir)
@@ -36,7 +37,7 @@ def main() -> None:
 
     raw_path = sample_dir / "rer_raw" / f"{args.date}.csv"
     weather_path = _pick_weather_file(sample_dir / "weather", args.date)
-    out_path = Path(args.out_dir) / f"merged_{args.date}.csv"
+    out_path = Path(args.out_dir) / f"merged_{args.date}.{args.format}"
 
     stop_index = derived_dir / "rer_stop_index.csv"
     stations = derived_dir / "stations.csv"
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
+import csv
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Iterable, Optional, Sequence, Tuple
+from typing import TYPE_CHECKING, Iterable, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
+from scipy import sparse
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
 
 
 @dataclass(frozen=True)
@@ -50,44 +53,78 @@ def _sum_to_zero_from_drop_first(
     if "const" not in params.index:
         raise ValueError("Model params missing intercept 'const'.")
 
-    # Stations
-    station_terms = params.filter(like=station_prefix)
-    station_map: Dict[str, float] = {k.replace(station_prefix, ""): float(v) for k, v in station_terms.items()}
-    station_map[baseline_station] = 0.0
+    names = params.index.astype(str)
+    values = params.to_numpy(dtype=np.float64)
 
-    avg_station = float(np.mean(list(station_map.values())))
-    station_centered = {k: v - avg_station for k, v in station_map.items()}
+    # Stations: dummy coefficients plus the dropped baseline at 0, centered on their mean
+    is_station = names.str.startswith(station_prefix)
+    station_codes = np.append(names[is_station].str[len(station_prefix):].to_numpy(), baseline_station)
+    station_vals = np.append(values[is_station], 0.0)
+    avg_station = float(station_vals.mean())
 
     # Hours
-    hour_terms = params.filter(like=hour_prefix)
-    hour_map: Dict[int, float] = {int(k.replace(hour_prefix, "")): float(v) for k, v in hour_terms.items()}
-    hour_map[int(baseline_hour)] = 0.0
-
-    avg_hour = float(np.mean(list(hour_map.values())))
-    hour_centered = {k: v - avg_hour for k, v in hour_map.items()}
+    is_hour = names.str.startswith(hour_prefix)
+    hours = np.append(names[is_hour].str[len(hour_prefix):].astype(int).to_numpy(), int(baseline_hour))
+    hour_vals = np.append(values[is_hour], 0.0)
+    avg_hour = float(hour_vals.mean())
 
     grand_mean = float(params["const"]) + avg_station + avg_hour
 
     station_df = (
-        pd.DataFrame({"station_code": list(station_centered.keys()), "fe_seconds": list(station_centered.values())})
+        pd.DataFrame({"station_code": station_codes, "fe_seconds": station_vals - avg_station})
           .sort_values("fe_seconds", ascending=False)
           .reset_index(drop=True)
     )
     hour_df = (
-        pd.DataFrame({"hour": list(hour_centered.keys()), "fe_seconds": list(hour_centered.values())})
+        pd.DataFrame({"hour": hours, "fe_seconds": hour_vals - avg_hour})
           .sort_values("hour")
           .reset_index(drop=True)
     )
     return grand_mean, station_df, hour_df
 
 
+def _one_hot_drop_first(values: pd.Series, prefix: str) -> Tuple[sparse.csr_matrix, list]:
+    """
+    Sparse drop-first dummies, named like pd.get_dummies(prefix=..., drop_first=True).
+    """
+    cat = pd.Categorical(values)
+    codes = cat.codes.astype(np.int64)
+    rows = np.flatnonzero(codes > 0)
+    mat = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, codes[rows] - 1)),
+        shape=(len(codes), len(cat.categories) - 1),
+    )
+    names = [f"{prefix}_{c}" for c in cat.categories[1:]]
+    return mat, names
+
+
+def _ols_hc1(x: sparse.csr_matrix, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
+    """
+    OLS with HC1 standard errors on a sparse design, via the (small, dense) normal equations.
+
+    Matches sm.OLS(y, x).fit(cov_type="HC1") without materializing the dense N x K design.
+    Returns (params, cov, r2).
+    """
+    n = x.shape[0]
+    xtx_inv = np.linalg.pinv((x.T @ x).toarray())
+    params = xtx_inv @ (x.T @ y)
+    resid = y - x @ params
+
+    rank = np.linalg.matrix_rank(xtx_inv)
+    meat = (x.T @ x.multiply(resid[:, None] ** 2)).toarray()
+    cov = xtx_inv @ meat @ xtx_inv * (n / (n - rank))
+
+    r2 = 1.0 - float(resid @ resid) / float(((y - y.mean()) ** 2).sum())
+    return params, cov, r2
+
+
 def fit_station_hour_fe(df: pd.DataFrame, spec: FEModelSpec) -> FEOutputs:
     required = [spec.y_col, spec.station_col, spec.hour_col, *spec.weather_cols]
     missing = [c for c in required if c not in df.columns]
     if missing:
         raise ValueError(f"Missing required columns: {missing}")
 
-    work = df[required].dropna().copy()
+    work = df[required].dropna()
 
     # Normalize hour to int if needed
     work[spec.hour_col] = work[spec.hour_col].astype(int)
@@ -95,103 +132,117 @@ def fit_station_hour_fe(df: pd.DataFrame, spec: FEModelSpec) -> FEOutputs:
     if spec.drop_hours_leq is not None:
         work = work.loc[work[spec.hour_col] > int(spec.drop_hours_leq)].copy()
 
-    # Center weather variables for interpretability
-    precip, temp, wind = spec.weather_cols
-    work["precip_centered"] = work[precip] - float(spec.ref_precip_mm)
-    work["temp_centered"] = work[temp] - float(spec.ref_temp_c)
-    work["wind_centered"] = work[wind] - float(spec.ref_wind_kmh)
+    # Center weather variables for interpretability. The three columns are centered
+    # with one (N, 3) broadcast against the reference vector, in float64: the panel holds
+    # per-hour means, and float32 storage would move the fitted effects.
+    weather_names = ["precip_centered", "temp_centered", "wind_centered"]
+    ref = np.array([spec.ref_precip_mm, spec.ref_temp_c, spec.ref_wind_kmh], dtype=np.float64)
+    work[weather_names] = work[list(spec.weather_cols)].to_numpy(dtype=np.float64) - ref
 
-    y = work[spec.y_col].astype(float)
+    y = work[spec.y_col].astype(float).to_numpy()
 
-    # Fixed effects dummies (drop-first)
-    station_d = pd.get_dummies(work[spec.station_col], prefix="station", drop_first=True).astype(float)
-    hour_d = pd.get_dummies(work[spec.hour_col], prefix="hour", drop_first=True).astype(float)
+    # Fixed effects dummies (drop-first), kept sparse: one non-zero per row and block
+    station_d, station_names = _one_hot_drop_first(work[spec.station_col], prefix="station")
+    hour_d, hour_names = _one_hot_drop_first(work[spec.hour_col], prefix="hour")
 
-    baseline_station = sorted(work[spec.station_col].unique())[0]
-    baseline_hour = sorted(work[spec.hour_col].unique())[0]
+    # Drop-first baselines are the smallest category of each block
+    baseline_station = work[spec.station_col].min()
+    baseline_hour = int(work[spec.hour_col].min())
 
-    x = pd.concat(
-        [
-            work[["precip_centered", "temp_centered", "wind_centered"]].astype(float),
-            station_d,
-            hour_d,
-        ],
-        axis=1,
-    )
-    x = sm.add_constant(x)
+    dense = np.column_stack([np.ones(len(work)), work[weather_names].to_numpy(dtype=np.float64)])
+    x = sparse.hstack([sparse.csr_matrix(dense), station_d, hour_d], format="csr")
+    names = ["const", *weather_names, *station_names, *hour_names]
 
-    model = sm.OLS(y, x)
-    res = model.fit(cov_type="HC1")
+    coef, cov, r2 = _ols_hc1(x, y)
+    params = pd.Series(coef, index=names)
 
     grand_mean, station_fe, hour_fe = _sum_to_zero_from_drop_first(
-        res.params,
+        params,
         baseline_station=baseline_station,
-        baseline_hour=int(baseline_hour),
+        baseline_hour=baseline_hour,
     )
 
     return FEOutputs(
-        r2=float(res.rsquared),
-        params=res.params,
-        cov=res.cov_params(),
+        r2=r2,
+        params=params,
+        cov=pd.DataFrame(cov, index=names, columns=names),
         grand_mean=grand_mean,
         station_fe=station_fe,
         hour_fe=hour_fe,
     )
 
 
+def _write_small_csv(path: Path, header: Sequence[str], rows: Iterable[Sequence[object]]) -> None:
+    """
+    Write a handful of rows with csv.writer; NaN is written empty, as DataFrame.to_csv does.
+    """
+    with path.open("w", newline="", encoding="utf-8") as fh:
+        writer = csv.writer(fh, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(["" if isinstance(v, float) and np.isnan(v) else v for v in row] for row in rows)
+
+
 def save_fe_outputs(out: FEOutputs, out_dir: Path) -> None:
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # Weather coefficients (centered)
-    weather = pd.DataFrame(
-        {
-            "term": ["precip_centered", "temp_centered", "wind_centered"],
-            "coef": [out.params.get("precip_centered", np.nan),
-                     out.params.get("temp_centered", np.nan),
-                     out.params.get("wind_centered", np.nan)],
-        }
+    terms = ["precip_centered", "temp_centered", "wind_centered"]
+    _write_small_csv(
+        out_dir / "weather_coefficients.csv",
+        ["term", "coef"],
+        [(t, out.params.get(t, np.nan)) for t in terms],
     )
-    weather.to_csv(out_dir / "weather_coefficients.csv", index=False)
 
     out.station_fe.to_csv(out_dir / "station_fixed_effects.csv", index=False)
     out.hour_fe.to_csv(out_dir / "hour_fixed_effects.csv", index=False)
 
-    summary = pd.DataFrame([{"r2": out.r2, "grand_mean_delay_s": out.grand_mean}])
-    summary.to_csv(out_dir / "model_summary.csv", index=False)
+    _write_small_csv(
+        out_dir / "model_summary.csv",
+        ["r2", "grand_mean_delay_s"],
+        [(out.r2, out.grand_mean)],
+    )
+
+
+def _save_figure(fig: Figure, path: Path) -> None:
+    # Render straight through Agg: no pyplot state, no interactive backend selection.
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig.tight_layout()
+    FigureCanvasAgg(fig).print_figure(path, dpi=200)
 
 
 def plot_fe_summaries(out: FEOutputs, out_dir: Path, top_n: int = 15) -> None:
+    # matplotlib is only imported when plots are requested; fitting and CSV output skip it.
+    from matplotlib.figure import Figure
+
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # Slowest stations
     slow = out.station_fe.head(int(top_n)).iloc[::-1]
-    plt.figure(figsize=(9, 6))
-    plt.barh(slow["station_code"], slow["fe_seconds"])
-    plt.xlabel("Fixed effect (seconds, deviation from network mean)")
-    plt.title(f"Top {top_n} stations with highest fixed effects")
-    plt.tight_layout()
-    plt.savefig(out_dir / "station_fe_top.png", dpi=200)
-    plt.close()
+    fig = Figure(figsize=(9, 6))
+    ax = fig.add_subplot()
+    ax.barh(slow["station_code"], slow["fe_seconds"])
+    ax.set_xlabel("Fixed effect (seconds, deviation from network mean)")
+    ax.set_title(f"Top {top_n} stations with highest fixed effects")
+    _save_figure(fig, out_dir / "station_fe_top.png")
 
     # Fastest stations
     fast = out.station_fe.tail(int(top_n)).iloc[::-1]
-    plt.figure(figsize=(9, 6))
-    plt.barh(fast["station_code"], fast["fe_seconds"])
-    plt.xlabel("Fixed effect (seconds, deviation from network mean)")
-    plt.title(f"Top {top_n} stations with lowest fixed effects")
-    plt.tight_layout()
-    plt.savefig(out_dir / "station_fe_bottom.png", dpi=200)
-    plt.close()
+    fig = Figure(figsize=(9, 6))
+    ax = fig.add_subplot()
+    ax.barh(fast["station_code"], fast["fe_seconds"])
+    ax.set_xlabel("Fixed effect (seconds, deviation from network mean)")
+    ax.set_title(f"Top {top_n} stations with lowest fixed effects")
+    _save_figure(fig, out_dir / "station_fe_bottom.png")
 
     # Hour profile
-    plt.figure(figsize=(9, 4))
-    plt.plot(out.hour_fe["hour"], out.hour_fe["fe_seconds"], marker="o")
-    plt.xlabel("Hour of day (Europe/Paris)")
-    plt.ylabel("Fixed effect (seconds)")
-    plt.title("Hourly fixed effects (deviation from network mean)")
-    plt.tight_layout()
-    plt.savefig(out_dir / "hour_fe_profile.png", dpi=200)
-    plt.close()
+    fig = Figure(figsize=(9, 4))
+    ax = fig.add_subplot()
+    ax.plot(out.hour_fe["hour"], out.hour_fe["fe_seconds"], marker="o")
+    ax.set_xlabel("Hour of day (Europe/Paris)")
+    ax.set_ylabel("Fixed effect (seconds)")
+    ax.set_title("Hourly fixed effects (deviation from network mean)")
+    _save_figure(fig, out_dir / "hour_fe_profile.png")
 
 
 def main() -> None:
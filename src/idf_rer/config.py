@@ -16,6 +16,7 @@ class Settings:
     data_dir: Path = Path("data")
     rer_raw_dir: Path = Path("data/rer_raw")
     rer_daily_dir: Path = Path("data/rer_daily")
+    storage_format: str = "csv"  # rer_raw / rer_daily file format: "csv" or "parquet"
 
     @staticmethod
     def from_env() -> "Settings":
@@ -27,4 +28,8 @@ class Settings:
         if not url:
             raise RuntimeError("Missing IDFM_ESTIMATED_TIMETABLE_URL (set it in .env).")
 
-        return Settings(prim_api_key=api_key, estimated_timetable_url=url)
+        storage_format = os.getenv("IDF_STORAGE_FORMAT", "csv").strip().lower() or "csv"
+        if storage_format not in ("csv", "parquet"):
+            raise RuntimeError(f"IDF_STORAGE_FORMAT must be 'csv' or 'parquet', got {storage_format!r}.")
+
+        return Settings(prim_api_key=api_key, estimated_timetable_url=url, storage_format=storage_format)
@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+import csv
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as papq
 
-from .gtfs_stop_index import parse_numeric_stop_code
+from .gtfs_stop_index import parse_numeric_stop_codes
+from .polling_pipeline import _read_raw
 
 
 @dataclass(frozen=True)
@@ -15,30 +22,128 @@ class EnrichmentPaths:
     stations_csv: Path  # your stations.csv with monomodal_stop_id + station_code
 
 
+_STATION_COLUMNS = ["station_code", "stop_name", "stop_lat", "stop_lon", "zone_id"]
+_STOP_INDEX_COLUMNS = ["numeric_code", "monomodal_stop_id"]
+
+
+def _read_catalog(csv_path: Path, columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Read the given columns of a derived catalog as strings, preferring its Parquet
+    sibling when it is up to date. Other catalog columns are never parsed.
+    """
+    pq = csv_path.with_suffix(".parquet")
+    if pq.exists() and (not csv_path.exists() or pq.stat().st_mtime >= csv_path.stat().st_mtime):
+        present = [c for c in columns if c in papq.read_schema(pq).names]
+        return pd.read_parquet(pq, columns=present).astype("string").astype(object).fillna(np.nan)
+    return pd.read_csv(csv_path, dtype=str, usecols=lambda c: c in columns)
+
+
+def _read_raw_text(raw_csv: Path) -> pd.DataFrame:
+    """
+    A rer_raw CSV with every column as text, as pd.read_csv(dtype=str) gives, through the
+    multithreaded Arrow parser. Types are declared from the header: Arrow must not infer
+    them (it would rewrite the ISO timestamps).
+    """
+    with raw_csv.open(newline="", encoding="utf-8") as fh:
+        header = next(csv.reader(fh), [])
+    table = pacsv.read_csv(
+        raw_csv,
+        convert_options=pacsv.ConvertOptions(
+            column_types={c: pa.string() for c in header},
+            strings_can_be_null=True,
+        ),
+    )
+    # split_blocks/self_destruct: no consolidation copy, Arrow memory freed column by column.
+    return table.to_pandas(split_blocks=True, self_destruct=True).fillna(np.nan)
+
+
+def _unique_on(df: pd.DataFrame, key: str, name: str) -> pd.DataFrame:
+    """
+    Exact duplicate rows dropped; a key that still maps to two different rows is an error,
+    as merge(validate="m:1") would report, instead of silently keeping one of them.
+    """
+    df = df.drop_duplicates()
+    dup = df[key].duplicated(keep=False) & df[key].notna()
+    if dup.any():
+        examples = df.loc[dup, key].unique()[:5].tolist()
+        raise ValueError(f"{name}: {key} is not unique (conflicting rows for {examples})")
+    return df.drop_duplicates(key)
+
+
+def _station_lookup(stop_index: pd.DataFrame, stations: pd.DataFrame) -> pd.DataFrame:
+    """
+    numeric_code -> monomodal_stop_id + station columns, one row per numeric_code.
+
+    Both hops are many-to-one; catalogs that break that raise ValueError.
+    """
+    idx = _unique_on(stop_index[_STOP_INDEX_COLUMNS], "numeric_code", "stop index")
+    idx = idx.set_index("numeric_code")["monomodal_stop_id"]
+    st = _unique_on(stations[["monomodal_stop_id", *_STATION_COLUMNS]], "monomodal_stop_id", "stations")
+    st = st.set_index("monomodal_stop_id")
+    lookup = st.reindex(idx.to_numpy())
+    lookup.index = idx.index
+    lookup.insert(0, "monomodal_stop_id", idx.to_numpy())
+    return lookup
+
+
+def _catalog_mtime(csv_path: Path) -> Optional[float]:
+    mtimes = [p.stat().st_mtime for p in (csv_path, csv_path.with_suffix(".parquet")) if p.exists()]
+    return max(mtimes, default=None)
+
+
+@lru_cache(maxsize=4)
+def _cached_station_lookup(
+    stop_index_csv: Path,
+    stations_csv: Path,
+    mtimes: Tuple[Optional[float], Optional[float]],
+) -> pd.DataFrame:
+    """
+    Build the numeric_code lookup once per catalog version (mtimes is part of the cache key).
+
+    The returned frame is shared between calls: callers must not modify it in place.
+    """
+    stop_index = _read_catalog(stop_index_csv, _STOP_INDEX_COLUMNS)
+    stations = _read_catalog(stations_csv, ["monomodal_stop_id", *_STATION_COLUMNS])
+    return _station_lookup(stop_index, stations)
+
+
 def enrich_raw_with_station_code(raw_csv: Path, out_csv: Path, paths: EnrichmentPaths) -> Path:
     """
     Add station metadata to a rer_raw daily file:
       stop_id -> numeric_code -> stop_index -> monomodal_stop_id -> stations -> station_code
     Works for both StopPoint:Q and StopArea:SP stop_id patterns.
+
+    out_csv with a ".parquet" suffix writes Parquet (zstd), anything else CSV.
     """
-    raw = pd.read_csv(raw_csv, dtype=str)
+    if raw_csv.suffix == ".parquet":
+        # A Parquet day may be a directory of per-poll files: read it like the pipeline
+        # does, so re-sent polls that are not compacted yet are counted once.
+        raw = _read_raw(raw_csv)
+    else:
+        raw = _read_raw_text(raw_csv)
     if "stop_id" not in raw.columns:
         raise ValueError(f"{raw_csv} has no stop_id column")
 
-    stop_index = pd.read_csv(paths.stop_index_csv, dtype=str)
-    stations = pd.read_csv(paths.stations_csv, dtype=str)
-
-    raw["numeric_code"] = raw["stop_id"].map(parse_numeric_stop_code)
-    raw = raw.dropna(subset=["numeric_code"]).copy()
+    # The catalogs are static reference data: reuse the lookup across days in one process.
+    station_lookup = _cached_station_lookup(
+        paths.stop_index_csv,
+        paths.stations_csv,
+        (_catalog_mtime(paths.stop_index_csv), _catalog_mtime(paths.stations_csv)),
+    )
 
-    # Join to stop index
-    tmp = raw.merge(stop_index[["numeric_code", "monomodal_stop_id"]].drop_duplicates(),
-                    on="numeric_code", how="left")
+    raw["numeric_code"] = parse_numeric_stop_codes(raw["stop_id"])
+    raw = raw.dropna(subset=["numeric_code"])
 
-    # Join to stations
-    tmp = tmp.merge(stations[["monomodal_stop_id", "station_code", "stop_name", "stop_lat", "stop_lon", "zone_id"]].drop_duplicates(),
-                    on="monomodal_stop_id", how="left", suffixes=("", "_station"))
+    # Both catalogs are small: compose them into one numeric_code -> station lookup
+    # so the raw frame is probed once instead of going through two merges.
+    lookup = station_lookup.reindex(raw["numeric_code"].to_numpy())
+    lookup.index = raw.index
+    lookup = lookup.rename(columns=lambda c: f"{c}_station" if c in raw.columns else c)
+    tmp = raw.join(lookup)
 
     out_csv.parent.mkdir(parents=True, exist_ok=True)
-    tmp.to_csv(out_csv, index=False)
+    if out_csv.suffix == ".parquet":
+        tmp.to_parquet(out_csv, index=False, compression="zstd")
+    else:
+        tmp.to_csv(out_csv, index=False)
     return out_csv
@@ -23,6 +23,13 @@ def parse_numeric_stop_code(stop_id: str) -> Optional[str]:
     return m.group(2) if m else None
 
 
+def parse_numeric_stop_codes(stop_ids: pd.Series) -> pd.Series:
+    """
+    Column version of parse_numeric_stop_code: one vectorized str.extract pass, NaN where absent.
+    """
+    return stop_ids.str.extract(_STOP_ID_RE, expand=True)[1]
+
+
 @dataclass(frozen=True)
 class GtfsStopIndexPaths:
     stops_txt: Path
@@ -91,4 +98,6 @@ def build_stop_index(paths: GtfsStopIndexPaths) -> Path:
 
     paths.out_csv.parent.mkdir(parents=True, exist_ok=True)
     df.to_csv(paths.out_csv, index=False)
+    # Columnar copy for readers that prefer it (see enrich.py); CSV stays the reference artifact.
+    df.to_parquet(paths.out_csv.with_suffix(".parquet"), index=False, compression="zstd")
     return paths.out_csv
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import os
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Optional, Tuple
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 from .config import Settings
 from .prim_client import fetch_estimated_timetable_json
@@ -22,8 +26,11 @@ def _service_day(local_ts: pd.Timestamp, cutoff_h: int, cutoff_m: int) -> str:
     Assign a poll timestamp to a service day (YYYY-MM-DD) with a cutoff at 02:30 local time.
     """
     local_ts = local_ts.tz_convert("Europe/Paris")
-    cutoff = local_ts.normalize() + pd.Timedelta(hours=cutoff_h, minutes=cutoff_m)
-    day = (local_ts - pd.Timedelta(days=1)).date() if local_ts < cutoff else local_ts.date()
+    # Compare wall-clock fields directly: no midnight/cutoff Timestamps to build, and the
+    # cutoff stays at 02:30 on the clock even on DST-change nights.
+    day = local_ts.date()
+    if (local_ts.hour, local_ts.minute) < (cutoff_h, cutoff_m):
+        day -= timedelta(days=1)
     return day.isoformat()
 
 
@@ -31,34 +38,124 @@ def _ensure_parent_dir(p: Path) -> None:
     p.parent.mkdir(parents=True, exist_ok=True)
 
 
-def _isoformat_with_colon_offset(s: pd.Series) -> pd.Series:
-    # +0100 -> +01:00
-    return s.dt.strftime("%Y-%m-%dT%H:%M:%S%z").str.replace(
-        r"(\+|\-)(\d{2})(\d{2})$", r"\1\2:\3", regex=True
+def _raw_schema(tz_local: str) -> pa.Schema:
+    """
+    On-disk schema of rer_raw Parquet files: native timestamps and compact counts.
+    """
+    return pa.schema(
+        [
+            ("poll_at_utc", pa.timestamp("us", tz="UTC")),
+            ("poll_at_local", pa.timestamp("us", tz=tz_local)),
+            ("stop_id", pa.string()),
+            ("line_code", pa.string()),
+            ("mean_delay_s", pa.float64()),
+            ("mean_lateness_s", pa.float64()),
+            ("n", pa.int32()),
+            ("n_neg", pa.int32()),
+            ("n_pos", pa.int32()),
+        ]
     )
 
 
+_RAW_KEY = ["poll_at_utc", "stop_id", "line_code"]
+
+
+def _typed_poll_rows(rows: pd.DataFrame, tz_local: str) -> pd.DataFrame:
+    """
+    aggregate_poll output (ISO strings) -> native timestamps, as stored in Parquet.
+    """
+    out = rows.copy()
+    out["poll_at_utc"] = pd.to_datetime(rows["poll_at_utc"], format="ISO8601", utc=True)
+    out["poll_at_local"] = pd.to_datetime(rows["poll_at_local"], format="ISO8601", utc=True).dt.tz_convert(tz_local)
+    return out
+
+
+def _read_raw(path: Path) -> pd.DataFrame:
+    if path.is_dir():
+        # Append-only service day: one file per poll (plus an optional compacted part).
+        # A re-sent poll upserts into its own file; the dedup covers compacted + re-sent overlaps.
+        return pd.read_parquet(path).drop_duplicates(subset=_RAW_KEY, keep="last", ignore_index=True)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype={"stop_id": str, "line_code": str})
+
+
+def _write_poll_parts(rows: pd.DataFrame, day_dir: Path, tz_local: str) -> None:
+    """
+    Write each poll as its own Parquet file in the service-day directory.
+
+    Files are named after poll_at_utc. Re-appending a poll upserts into its file on
+    (poll_at_utc, stop_id, line_code), as the CSV path does: re-sent keys are replaced,
+    rows the retry does not repeat are kept. Files are written under a dot-prefixed
+    temporary name that dataset readers ignore, then renamed.
+    """
+    day_dir.mkdir(parents=True, exist_ok=True)
+    for poll_at_utc, part in rows.groupby("poll_at_utc", sort=False):
+        target = day_dir / f"poll-{poll_at_utc.strftime('%Y%m%dT%H%M%S%fZ')}.parquet"
+        if target.exists():
+            part = pd.concat([pd.read_parquet(target), part], ignore_index=True)
+            part = part.drop_duplicates(subset=_RAW_KEY, keep="last")
+        tmp = day_dir / f".{target.name}.tmp"
+        _write_raw_parquet(part, tmp, tz_local)
+        os.replace(tmp, target)
+
+
+def _write_raw_parquet(df: pd.DataFrame, path: Path, tz_local: str) -> None:
+    """
+    Write raw rows with one row group per line_code, so line filters prune on statistics:
+    pd.read_parquet(day, filters=[("line_code", "==", "RER A")]) skips the other lines.
+    """
+    df = df.sort_values(["line_code", *_RAW_KEY])
+    table = pa.Table.from_pandas(df, schema=_raw_schema(tz_local), preserve_index=False)
+    sizes = df.groupby("line_code", observed=True, sort=True, dropna=False).size().to_numpy()
+    with pq.ParquetWriter(path, table.schema, compression="zstd") as writer:
+        for offset, size in zip(np.cumsum(sizes) - sizes, sizes):
+            writer.write_table(table.slice(offset, size))
+
+
+def _strftime(s: pd.Series, fmt: str) -> pd.Series:
+    """
+    Series.dt.strftime for tz-aware timestamps through Arrow's vectorized kernel.
+
+    Truncated to whole seconds first: Arrow's %S would otherwise print the fraction.
+    """
+    if s.dt.tz is None:
+        return s.dt.strftime(fmt.replace("%Ez", "%z"))
+    arr = pa.Array.from_pandas(s)
+    arr = arr.cast(pa.timestamp("s", tz=arr.type.tz), safe=False)
+    return pd.Series(pc.strftime(arr, format=fmt).to_numpy(zero_copy_only=False), index=s.index)
+
+
+def _isoformat_with_colon_offset(s: pd.Series) -> pd.Series:
+    # %Ez renders the offset as +01:00 directly, no regex pass over the strings
+    return _strftime(s, "%Y-%m-%dT%H:%M:%S%Ez")
+
+
 def build_rer_events(settings: Settings) -> pd.DataFrame:
     """
     One PRIM snapshot -> flattened events -> RER subset within lead-time horizon.
     """
     payload = fetch_estimated_timetable_json(settings)
-    df = flatten_estimated_timetable(payload)
+    # Non-RER journeys (most of the network feed) are dropped before their calls are walked.
+    df = flatten_estimated_timetable(payload, line_prefix="RER ")
 
     if df.empty:
         return df
 
-    # Keep only RER (line_code starts with "RER ")
-    df["line_code"] = df["line_code"].astype(str)
-    df = df[df["line_code"].str.startswith("RER ", na=False)].copy()
+    # Keep only RER (line_code starts with "RER "): test the few categories once,
+    # then gather per row through the codes (code -1, a missing line, maps to False).
+    line_code = df["line_code"].astype("category")
+    is_rer = np.append(line_code.cat.categories.astype(str).str.startswith("RER "), False)
+    keep = is_rer[line_code.cat.codes.to_numpy()]
 
     # Keep only events with delay and scheduled timestamp
-    df = df[df["delay_seconds"].notna() & df["scheduled_time_utc"].notna()].copy()
+    keep &= (df["delay_seconds"].notna() & df["scheduled_time_utc"].notna()).to_numpy()
 
     # Lead-time filter: scheduled within next 10 minutes
-    df = df[df["lead_time_seconds"].between(0, settings.lead_time_horizon_s)].copy()
+    keep &= df["lead_time_seconds"].between(0, settings.lead_time_horizon_s).to_numpy()
 
-    return df
+    # One row selection for all three filters; it already returns a new frame.
+    return df[keep]
 
 
 def aggregate_poll(df_events: pd.DataFrame, tz_local: str = "Europe/Paris") -> pd.DataFrame:
@@ -79,18 +176,25 @@ def aggregate_poll(df_events: pd.DataFrame, tz_local: str = "Europe/Paris") -> p
     poll_at_utc = poll_at_utc.iloc[0] if not poll_at_utc.empty else pd.to_datetime(_utc_now(), utc=True)
     poll_at_local = poll_at_utc.tz_convert(tz_local)
 
-    def mean_lateness(s: pd.Series) -> float:
-        return s.clip(lower=0).mean()
-
-    g = (
-        df_events.groupby(["stop_id", "line_code"], as_index=False)["delay_seconds"]
-        .agg(
-            mean_delay_s="mean",
-            mean_lateness_s=mean_lateness,
-            n="count",
-            n_neg=lambda s: int((s < 0).sum()),
-            n_pos=lambda s: int((s > 0).sum()),
-        )
+    # Per-row lateness and sign flags computed once, so every aggregation below is a
+    # built-in (Cython) reducer rather than a Python callback per group.
+    delay = df_events["delay_seconds"].to_numpy(dtype=float)
+    work = pd.DataFrame(
+        {
+            "stop_id": df_events["stop_id"].to_numpy(),
+            "line_code": df_events["line_code"].array,
+            "delay_seconds": delay,
+            "lateness_s": np.maximum(delay, 0),
+            "is_neg": delay < 0,
+            "is_pos": delay > 0,
+        }
+    )
+    g = work.groupby(["stop_id", "line_code"], as_index=False, observed=True).agg(
+        mean_delay_s=("delay_seconds", "mean"),
+        mean_lateness_s=("lateness_s", "mean"),
+        n=("delay_seconds", "count"),
+        n_neg=("is_neg", "sum"),
+        n_pos=("is_pos", "sum"),
     )
 
     g["poll_at_utc"] = poll_at_utc
@@ -109,9 +213,25 @@ def aggregate_poll(df_events: pd.DataFrame, tz_local: str = "Europe/Paris") -> p
     ]
 
 
+def _raw_day_path(settings: Settings, day: str) -> Path:
+    """
+    data/rer_raw/<day>.<storage_format>, unless the day was started in the other format.
+
+    A change of storage_format takes effect from the next service day, so a day polled
+    across the switch is never split between a .csv and a .parquet.
+    """
+    other = "parquet" if settings.storage_format == "csv" else "csv"
+    started = settings.rer_raw_dir / f"{day}.{other}"
+    return started if started.exists() else settings.rer_raw_dir / f"{day}.{settings.storage_format}"
+
+
 def append_raw_poll_rows(rows: pd.DataFrame, settings: Settings) -> Optional[Path]:
     """
-    Append poll rows to data/rer_raw/<service_day>.csv with idempotency on (poll_at_utc, stop_id, line_code).
+    Append poll rows to data/rer_raw/<service_day>.<storage_format> with idempotency on
+    (poll_at_utc, stop_id, line_code).
+
+    With Parquet storage the service day is a directory and each poll only writes its own
+    file (no read-modify-write of the day so far); see compact_service_day.
     """
     if rows is None or rows.empty:
         return None
@@ -123,13 +243,23 @@ def append_raw_poll_rows(rows: pd.DataFrame, settings: Settings) -> Optional[Pat
         poll_local = poll_local.tz_convert(settings.tz_local)
 
     day = _service_day(poll_local, settings.service_day_cutoff_h, settings.service_day_cutoff_m)
-    out_path = settings.rer_raw_dir / f"{day}.csv"
+    out_path = _raw_day_path(settings, day)
     settings.rer_raw_dir.mkdir(parents=True, exist_ok=True)
 
-    key_cols = ["poll_at_utc", "stop_id", "line_code"]
+    key_cols = _RAW_KEY
+    if out_path.suffix == ".parquet":
+        _write_poll_parts(_typed_poll_rows(rows, settings.tz_local), out_path, settings.tz_local)
+        return out_path
 
     if out_path.exists():
-        cur = pd.read_csv(out_path, dtype={"stop_id": str, "line_code": str})
+        # Common case, a new snapshot: only the key column is read to rule out a re-sent
+        # poll, then the rows are appended in place instead of rewriting the whole day.
+        seen = pd.read_csv(out_path, usecols=["poll_at_utc"], dtype=str)["poll_at_utc"]
+        if not rows["poll_at_utc"].isin(seen).any():
+            rows.sort_values(key_cols).to_csv(out_path, mode="a", header=False, index=False)
+            return out_path
+
+        cur = _read_raw(out_path)
         merged = pd.concat([cur, rows], ignore_index=True)
         merged.drop_duplicates(subset=key_cols, keep="last", inplace=True)
         merged.sort_values(key_cols, inplace=True)
@@ -141,40 +271,60 @@ def append_raw_poll_rows(rows: pd.DataFrame, settings: Settings) -> Optional[Pat
     return out_path
 
 
-def rebuild_daily_from_raw(raw_path: Path, settings: Settings, bin_sec: int) -> Path:
+def compact_service_day(day_dir: Path, settings: Settings) -> Path:
     """
-    Build data/rer_daily/<day>.csv by binning in local time and using train-count weighted averages.
+    Fold the per-poll files of a Parquet service day into a single deduplicated part.
+
+    Meant for closed service days (past the cutoff, no poll can land there anymore), e.g.
+    in a nightly job; only the files present when compaction starts are removed.
     """
-    df = pd.read_csv(raw_path, dtype={"stop_id": str, "line_code": str})
-    out_path = settings.rer_daily_dir / raw_path.name
-    settings.rer_daily_dir.mkdir(parents=True, exist_ok=True)
+    parts = sorted(day_dir.glob("*.parquet"))
+    if len(parts) <= 1:
+        return day_dir
 
-    if df.empty:
-        df.to_csv(out_path, index=False)
-        return out_path
+    df = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+    df = df.drop_duplicates(subset=_RAW_KEY, keep="last")
 
-    df["poll_at_utc"] = pd.to_datetime(df["poll_at_utc"], utc=True, errors="coerce")
-    df["poll_at_local"] = pd.to_datetime(df["poll_at_local"], errors="coerce")
+    target = day_dir / "compacted.parquet"
+    tmp = day_dir / f".{target.name}.tmp"
+    _write_raw_parquet(df, tmp, settings.tz_local)
+    os.replace(tmp, target)
+    for p in parts:
+        if p != target:
+            p.unlink()
+    return day_dir
 
-    df["mean_delay_s"] = pd.to_numeric(df["mean_delay_s"], errors="coerce")
-    df["mean_lateness_s"] = pd.to_numeric(df["mean_lateness_s"], errors="coerce")
-    df["n"] = pd.to_numeric(df["n"], errors="coerce").fillna(0).astype(int)
-    df["n_neg"] = pd.to_numeric(df["n_neg"], errors="coerce").fillna(0).astype(int)
-    df["n_pos"] = pd.to_numeric(df["n_pos"], errors="coerce").fillna(0).astype(int)
 
-    freq = f"{int(bin_sec)}S"
-    bin_start = df["poll_at_local"].dt.tz_convert(settings.tz_local).dt.floor(freq)
-    df["poll_bin_start_local_iso"] = _isoformat_with_colon_offset(bin_start)
+def _daily_bins(df: pd.DataFrame, settings: Settings, bin_sec: int, typed: bool) -> pd.DataFrame:
+    """
+    Raw poll rows -> one daily row per (bin, stop_id, line_code), train-count weighted.
 
-    if bin_sec % 60 == 0:
-        df["poll_bin_local"] = bin_start.dt.strftime("%Y-%m-%d %H:%M")
+    typed: rows come from Parquet (native timestamps and numbers), not from CSV text.
+    """
+    if typed:
+        # Parquet raw files are typed on write (_raw_schema): nothing to coerce.
+        df[["n", "n_neg", "n_pos"]] = df[["n", "n_neg", "n_pos"]].astype(int)
     else:
-        df["poll_bin_local"] = bin_start.dt.strftime("%Y-%m-%d %H:%M:%S")
+        # aggregate_poll writes both columns as ISO-8601: skip per-file format inference.
+        df["poll_at_utc"] = pd.to_datetime(df["poll_at_utc"], utc=True, errors="coerce", format="ISO8601")
+        df["poll_at_local"] = pd.to_datetime(df["poll_at_local"], errors="coerce", format="ISO8601")
+
+        df["mean_delay_s"] = pd.to_numeric(df["mean_delay_s"], errors="coerce")
+        df["mean_lateness_s"] = pd.to_numeric(df["mean_lateness_s"], errors="coerce")
+        df["n"] = pd.to_numeric(df["n"], errors="coerce").fillna(0).astype(int)
+        df["n_neg"] = pd.to_numeric(df["n_neg"], errors="coerce").fillna(0).astype(int)
+        df["n_pos"] = pd.to_numeric(df["n_pos"], errors="coerce").fillna(0).astype(int)
+
+    freq = f"{int(bin_sec)}S"
+    df["bin_start"] = df["poll_at_local"].dt.tz_convert(settings.tz_local).dt.floor(freq)
 
     df["w_delay"] = df["mean_delay_s"] * df["n"]
     df["w_late"] = df["mean_lateness_s"] * df["n"]
 
-    gb = df.groupby(["poll_bin_local", "poll_bin_start_local_iso", "stop_id", "line_code"], as_index=False).agg(
+    # Group on the bin timestamp itself; its two string renderings are only
+    # formatted once per output row instead of once per raw row. Groups are left
+    # unsorted: the result is sorted once, on its final columns, below.
+    gb = df.groupby(["bin_start", "stop_id", "line_code"], as_index=False, sort=False).agg(
         sum_w_delay=("w_delay", "sum"),
         sum_w_late=("w_late", "sum"),
         n=("n", "sum"),
@@ -184,25 +334,83 @@ def rebuild_daily_from_raw(raw_path: Path, settings: Settings, bin_sec: int) ->
         last_poll_at_local=("poll_at_local", "max"),
     )
 
+    gb["poll_bin_start_local_iso"] = _isoformat_with_colon_offset(gb["bin_start"])
+    if bin_sec % 60 == 0:
+        gb["poll_bin_local"] = _strftime(gb["bin_start"], "%Y-%m-%d %H:%M")
+    else:
+        gb["poll_bin_local"] = _strftime(gb["bin_start"], "%Y-%m-%d %H:%M:%S")
+
     gb["mean_delay_s"] = (gb["sum_w_delay"] / gb["n"]).replace([np.inf, -np.inf], np.nan).round(3)
     gb["mean_lateness_s"] = (gb["sum_w_late"] / gb["n"]).replace([np.inf, -np.inf], np.nan).round(3)
 
-    gb = gb[
+    return gb[
         ["poll_bin_local", "poll_bin_start_local_iso", "stop_id", "line_code",
          "mean_delay_s", "mean_lateness_s", "n", "n_neg", "n_pos",
          "last_poll_at_utc", "last_poll_at_local"]
     ].sort_values(["poll_bin_local", "stop_id", "line_code"])
 
-    gb.to_csv(out_path, index=False)
+
+def _write_daily(df: pd.DataFrame, out_path: Path) -> None:
+    if out_path.suffix == ".parquet":
+        df.to_parquet(out_path, index=False, compression="zstd")
+    else:
+        df.to_csv(out_path, index=False)
+
+
+def rebuild_daily_from_raw(raw_path: Path, settings: Settings, bin_sec: int) -> Path:
+    """
+    Build data/rer_daily/<day>.<ext> by binning in local time and using train-count weighted averages.
+
+    The daily file uses the same format (suffix) as the raw file it is built from.
+    """
+    df = _read_raw(raw_path)
+    out_path = settings.rer_daily_dir / raw_path.name
+    settings.rer_daily_dir.mkdir(parents=True, exist_ok=True)
+
+    if df.empty:
+        _write_daily(df, out_path)
+        return out_path
+
+    _write_daily(_daily_bins(df, settings, bin_sec, typed=raw_path.suffix == ".parquet"), out_path)
+    return out_path
+
+
+def rebuild_daily_incremental(raw_path: Path, settings: Settings, bin_sec: int, new_rows: pd.DataFrame) -> Path:
+    """
+    Update the daily file for the bins touched by new_rows (usually the current one) only.
+
+    Those bins are recomputed from the raw rows that fall in them, read from the Parquet
+    service-day directory with a poll_at_utc filter (files outside the window are pruned
+    on their statistics), and spliced into the existing daily file in place of the old
+    rows. Results are identical to rebuild_daily_from_raw, which stays the fallback: CSV
+    storage, a missing daily file, or a full rebuild after compact_service_day.
+    """
+    out_path = settings.rer_daily_dir / raw_path.name
+    if not raw_path.is_dir() or not out_path.exists() or new_rows is None or new_rows.empty:
+        return rebuild_daily_from_raw(raw_path, settings, bin_sec)
+
+    polls = pd.to_datetime(new_rows["poll_at_utc"], format="ISO8601", utc=True).drop_duplicates()
+    bins = polls.dt.tz_convert(settings.tz_local).dt.floor(f"{int(bin_sec)}S").drop_duplicates()
+    lo = bins.min().tz_convert("UTC")
+    hi = bins.max().tz_convert("UTC") + pd.Timedelta(seconds=int(bin_sec))
+
+    window = pd.read_parquet(raw_path, filters=[("poll_at_utc", ">=", lo), ("poll_at_utc", "<", hi)])
+    window = window.drop_duplicates(subset=_RAW_KEY, keep="last", ignore_index=True)
+    fresh = _daily_bins(window, settings, bin_sec, typed=True)
+
+    daily = pd.read_parquet(out_path)
+    stale = daily["poll_bin_start_local_iso"].isin(fresh["poll_bin_start_local_iso"].unique())
+    daily = pd.concat([daily.loc[~stale], fresh], ignore_index=True)
+    _write_daily(daily.sort_values(["poll_bin_local", "stop_id", "line_code"]), out_path)
     return out_path
 
 
 def run_one_poll(settings: Settings, bin_sec: int) -> Tuple[Optional[Path], Optional[Path]]:
     """
-    End-to-end: fetch snapshot -> filter -> aggregate -> append RAW -> rebuild DAILY.
+    End-to-end: fetch snapshot -> filter -> aggregate -> append RAW -> update DAILY.
     """
     events = build_rer_events(settings)
     rows = aggregate_poll(events, tz_local=settings.tz_local)
     raw_path = append_raw_poll_rows(rows, settings=settings)
-    daily_path = rebuild_daily_from_raw(raw_path, settings=settings, bin_sec=bin_sec) if raw_path else None
+    daily_path = rebuild_daily_incremental(raw_path, settings=settings, bin_sec=bin_sec, new_rows=rows) if raw_path else None
     return raw_path, daily_path
@@ -1,13 +1,44 @@
 from __future__ import annotations
 
+import atexit
+import json
 import time
 from typing import Any, Dict, Optional
 
 import httpx
 
+try:
+    import orjson
+except ImportError:  # optional speed-up; the stdlib decoder gives the same result
+    orjson = None
+
 from .config import Settings
 
 
+_CLIENT: Optional[httpx.Client] = None
+
+
+def _client() -> httpx.Client:
+    """
+    Process-wide client: polls (and retries) reuse one keep-alive connection to PRIM
+    instead of paying a TCP + TLS handshake each time.
+    """
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.Client(limits=httpx.Limits(max_keepalive_connections=4))
+        atexit.register(_CLIENT.close)
+    return _CLIENT
+
+
+def _decode_json(content: bytes) -> Dict[str, Any]:
+    """
+    Decode a response body; SIRI snapshots are multi-MB, so prefer orjson when installed.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
 def fetch_estimated_timetable_json(settings: Settings, timeout_s: float = 30.0) -> Dict[str, Any]:
     """
     Fetch a single Estimated Timetable snapshot from IDFM PRIM.
@@ -24,10 +55,9 @@ def fetch_estimated_timetable_json(settings: Settings, timeout_s: float = 30.0)
         if b:
             time.sleep(b)
         try:
-            with httpx.Client(timeout=timeout) as client:
-                r = client.get(settings.estimated_timetable_url, headers=headers)
-                r.raise_for_status()
-                return r.json()
+            r = _client().get(settings.estimated_timetable_url, headers=headers, timeout=timeout)
+            r.raise_for_status()
+            return _decode_json(r.content)
         except Exception as e:
             last_err = e
 
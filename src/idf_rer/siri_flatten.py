@@ -22,13 +22,17 @@ def _first(*vals: Any) -> Any:
     return None
 
 
-def flatten_estimated_timetable(payload: Dict[str, Any]) -> pd.DataFrame:
+def flatten_estimated_timetable(payload: Dict[str, Any], line_prefix: Optional[str] = None) -> pd.DataFrame:
     """
     Flatten a SIRI EstimatedTimetableDelivery payload into an event table.
 
     Output columns:
       snapshot_at_utc, stop_id, stop_name, line_code, direction, destination,
       scheduled_time_utc, rt_time_utc, delay_seconds, lead_time_seconds, vehicle_journey_id
+
+    With line_prefix, journeys whose line_code does not start with it are skipped before
+    any of their calls are read, and line_code is categorical. Without it, line_code keeps
+    the raw values, which may be SIRI's list form ([{"value": ...}]).
     """
     siri = payload.get("Siri", payload)
     sd = siri.get("ServiceDelivery", {}) if isinstance(siri, dict) else {}
@@ -37,7 +41,16 @@ def flatten_estimated_timetable(payload: Dict[str, Any]) -> pd.DataFrame:
     snapshot_at_utc = pd.to_datetime(snapshot_ts, utc=True, errors="coerce")
 
     deliveries = _as_list(sd.get("EstimatedTimetableDelivery"))
-    rows: List[Dict[str, Any]] = []
+
+    # One list per output column (SoA); timestamps stay raw strings until the end.
+    stop_ids: List[Any] = []
+    stop_names: List[Any] = []
+    line_codes: List[Any] = []
+    directions: List[Any] = []
+    destinations: List[Any] = []
+    aimed_times: List[Any] = []
+    expected_times: List[Any] = []
+    vjids: List[Any] = []
 
     for d in deliveries:
         frames = _as_list(d.get("EstimatedJourneyVersionFrame"))
@@ -45,6 +58,8 @@ def flatten_estimated_timetable(payload: Dict[str, Any]) -> pd.DataFrame:
             journeys = _as_list(f.get("EstimatedVehicleJourney"))
             for j in journeys:
                 line_code = _first(j.get("PublishedLineName"), j.get("LineRef"))
+                if line_prefix is not None and not (isinstance(line_code, str) and line_code.startswith(line_prefix)):
+                    continue
                 destination = _first(j.get("DestinationName"), j.get("DestinationDisplay"))
                 direction = _first(j.get("DirectionRef"))
                 vjid = _first(j.get("VehicleJourneyRef noting"), j.get("VehicleJourneyRef"), j.get("DatedVehicleJourneyRef"))
@@ -57,47 +72,42 @@ def flatten_estimated_timetable(payload: Dict[str, Any]) -> pd.DataFrame:
                     calls = _as_list(calls_container)
 
                 for c in calls:
-                    stop_id = _first(c.get("StopPointRef"), c.get("StopAreaRef"))
-                    stop_name = _first(c.get("StopPointName"), c.get("StopAreaName"))
-
-                    aimed = _first(c.get("AimedArrivalTime"), c.get("AimedDepartureTime"))
-                    expected = _first(c.get("ExpectedArrivalTime"), c.get("ExpectedDepartureTime"))
-
-                    sched = pd.to_datetime(aimed, utc=True, errors="coerce")
-                    rt = pd.to_datetime(expected, utc=True, errors="coerce")
-
-                    delay_s = None
-                    lead_s = None
-                    if pd.notna(sched) and pd.notna(rt):
-                        delay_s = (rt - sched).total_seconds()
-                    if pd.notna(snapshot_at_utc) and pd.notna(sched):
-                        lead_s = (sched - snapshot_at_utc).total_seconds()
-
-                    rows.append(
-                        dict(
-                            snapshot_at_utc=snapshot_at_utc,
-                            stop_id=stop_id,
-                            stop_name=stop_name,
-                            line_code=line_code,
-                            direction=direction,
-                            destination=destination,
-                            scheduled_time_utc=sched,
-                            rt_time_utc=rt,
-                            delay_seconds=delay_s,
-                            lead_time_seconds=lead_s,
-                            vehicle_journey_id=vjid,
-                        )
-                    )
-
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return df
-
-    # Normalize dtypes
-    df["snapshot_at_utc"] = pd.to_datetime(df["snapshot_at_utc"], utc=True, errors="coerce")
-    df["scheduled_time_utc"] = pd.to_datetime(df["scheduled_time_utc"], utc=True, errors="coerce")
-    df["rt_time_utc"] = pd.to_datetime(df["rt_time_utc"], utc=True, errors="coerce")
-    df["delay_seconds"] = pd.to_numeric(df["delay_seconds"], errors="coerce")
-    df["lead_time_seconds"] = pd.to_numeric(df["lead_time_seconds"], errors="coerce")
+                    stop_ids.append(_first(c.get("StopPointRef"), c.get("StopAreaRef")))
+                    stop_names.append(_first(c.get("StopPointName"), c.get("StopAreaName")))
+                    aimed_times.append(_first(c.get("AimedArrivalTime"), c.get("AimedDepartureTime")))
+                    expected_times.append(_first(c.get("ExpectedArrivalTime"), c.get("ExpectedDepartureTime")))
+                    line_codes.append(line_code)
+                    directions.append(direction)
+                    destinations.append(destination)
+                    vjids.append(vjid)
+
+    if not stop_ids:
+        return pd.DataFrame()
+
+    # Parse each timestamp column once; SIRI timestamps are ISO-8601 with an offset or "Z".
+    sched = pd.to_datetime(pd.Series(aimed_times, dtype=object), utc=True, errors="coerce", format="ISO8601")
+    rt = pd.to_datetime(pd.Series(expected_times, dtype=object), utc=True, errors="coerce", format="ISO8601")
+    snap = pd.Series(snapshot_at_utc, index=sched.index, dtype="datetime64[ns, UTC]")
+
+    df = pd.DataFrame(
+        {
+            "snapshot_at_utc": snap,
+            "stop_id": stop_ids,
+            "stop_name": stop_names,
+            "line_code": line_codes,
+            "direction": directions,
+            "destination": destinations,
+            "scheduled_time_utc": sched,
+            "rt_time_utc": rt,
+            "delay_seconds": (rt - sched).dt.total_seconds(),
+            "lead_time_seconds": (sched - snap).dt.total_seconds(),
+            "vehicle_journey_id": vjids,
+        }
+    )
+
+    # A snapshot carries a few dozen distinct lines over thousands of calls. Only the
+    # prefix filter guarantees plain strings; list-form names are not hashable.
+    if line_prefix is not None:
+        df["line_code"] = df["line_code"].astype("category")
 
     return df
@@ -3,15 +3,16 @@ import pandas as pd
 
 
 def build_station_catalog(stop_index_csv: Path, out_csv: Path) -> pd.DataFrame:
-    idx = pd.read_csv(stop_index_csv, dtype=str).fillna("")
     required = {"quay_code","monomodal_stop_id","monomodal_code","stop_name","parent_station","stop_lat","stop_lon","zone_id"}
+    idx = pd.read_csv(stop_index_csv, dtype=str, usecols=lambda c: c in required).fillna("")
     missing = required - set(idx.columns)
     if missing:
         raise RuntimeError(f"stop index missing columns: {', '.join(sorted(missing))}")
 
-    g = idx.groupby(["monomodal_stop_id","monomodal_code","stop_name","parent_station","stop_lat","stop_lon","zone_id"], as_index=False).agg(
-        n_quays=("quay_code", "nunique"),
-    )
+    # n_quays = distinct quay codes per station: dedup the (station, quay) pairs, then count rows
+    keys = ["monomodal_stop_id","monomodal_code","stop_name","parent_station","stop_lat","stop_lon","zone_id"]
+    g = idx.drop_duplicates([*keys, "quay_code"]).groupby(keys, as_index=False).size()
+    g = g.rename(columns={"size": "n_quays"})
 
     # add placeholders for enrichment steps (population density, line flags, etc.)
     g["pop_density_km2"] = ""
@@ -27,4 +28,5 @@ def build_station_catalog(stop_index_csv: Path, out_csv: Path) -> pd.DataFrame:
     g = g[cols]
     out_csv.parent.mkdir(parents=True, exist_ok=True)
     g.to_csv(out_csv, index=False)
+    g.to_parquet(out_csv.with_suffix(".parquet"), index=False, compression="zstd")
     return g
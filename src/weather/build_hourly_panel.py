@@ -1,10 +1,26 @@
 from __future__ import annotations
 
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+
+
+# Merged files produced by older aggregation scripts carry a "_mean" suffix.
+_METRIC_ALIASES = {
+    "mean_delay_s_mean": "mean_delay_s",
+    "precipitation_mean": "precipitation",
+    "temperature_2m_mean": "temperature_2m",
+    "wind_speed_10m_mean": "wind_speed_10m",
+}
+_KEY_COLUMNS = ("station_code", "stop_name", "poll_at_local", "poll_at_utc")
+_GROUP_KEYS = ["station_code", "date", "hour"]
 
 
 @dataclass(frozen=True)
@@ -14,85 +30,183 @@ class HourlyPanelConfig:
     metrics: List[str] = None
     min_polls_per_hour: int = 1
     blacklist_stations: List[str] = None
+    n_workers: Optional[int] = None  # processes used to read merged files (default: all cores)
+    keep_date_column: bool = False
 
     def __post_init__(self):
         object.__setattr__(self, "metrics", self.metrics or ["mean_delay_s", "precipitation", "temperature_2m", "wind_speed_10m"])
         object.__setattr__(self, "blacklist_stations", self.blacklist_stations or [])
+        object.__setattr__(self, "n_workers", self.n_workers or os.cpu_count() or 1)
+
+
+def _read_header(file: Path) -> Tuple[str, List[str]]:
+    """
+    Detect the delimiter (comma, or tab for some exports) from the header line.
+    """
+    with file.open(newline="", encoding="utf-8") as fh:
+        header = fh.readline().rstrip("\r\n")
+    sep = "," if len(header.split(",")) >= 2 else "\t"
+    return sep, header.split(sep)
+
+
+def _merged_files(merged_dir: Path) -> List[Path]:
+    """
+    merged_<day>.csv and merged_<day>.parquet files; Parquet wins when both exist for a day.
+    """
+    by_day = {f.stem: f for f in merged_dir.glob("merged_*.csv")}
+    by_day.update({f.stem: f for f in merged_dir.glob("merged_*.parquet")})
+    return [by_day[k] for k in sorted(by_day)]
 
 
 def _load_one(file: Path, cfg: HourlyPanelConfig) -> Optional[pd.DataFrame]:
+    dtypes = {"station_code": "category", "stop_name": "string"}
     try:
-        df = pd.read_csv(file)
-        if len(df.columns) < 2:
-            df = pd.read_csv(file, sep="\t")
+        if file.suffix == ".parquet":
+            sep, names = None, pq.read_schema(file).names
+        else:
+            sep, names = _read_header(file)
     except Exception:
-        try:
-            df = pd.read_csv(file, sep="\t")
-        except Exception:
-            return None
+        return None
+
+    # Project before parsing, like a lazy scan would: only the one timestamp column we
+    # group on is read (Arrow parses both when they are present), plus keys and metrics.
+    time_col = "poll_at_local" if "poll_at_local" in names else "poll_at_utc"
+    if time_col not in names:
+        return None
+    wanted = {"station_code", "stop_name", time_col, *cfg.metrics, *_METRIC_ALIASES}
+    columns = [c for c in names if c in wanted]
+    try:
+        if file.suffix == ".parquet":
+            df = pd.read_parquet(file, columns=columns)
+            df = df.astype({k: v for k, v in dtypes.items() if k in df.columns})
+            # merge_daily_raw_with_weather keeps raw columns as text; CSV reads infer numbers.
+            for c in df.columns.difference([*_KEY_COLUMNS]):
+                df[c] = pd.to_numeric(df[c], errors="coerce")
+        else:
+            df = pd.read_csv(file, sep=sep, engine="pyarrow", usecols=columns, dtype=dtypes)
+    except Exception:
+        return None
 
     # normalize common "mean" suffix columns
-    df = df.rename(
-        columns={
-            "mean_delay_s_mean": "mean_delay_s",
-            "precipitation_mean": "precipitation",
-            "temperature_2m_mean": "temperature_2m",
-            "wind_speed_10m_mean": "wind_speed_10m",
-        }
-    )
+    df = df.rename(columns=_METRIC_ALIASES)
+
+    # Producers in this repo write ISO-8601; the explicit format keeps pandas on its C parser.
+    df[time_col] = pd.to_datetime(df[time_col], format="ISO8601", utc=True, errors="coerce")
 
+    # Blacklist and unparseable timestamps filtered in one pass (a single row copy).
+    keep_rows = df[time_col].notna()
     if "stop_name" in df.columns and cfg.blacklist_stations:
-        df = df[~df["stop_name"].isin(cfg.blacklist_stations)].copy()
+        keep_rows &= ~df["stop_name"].isin(cfg.blacklist_stations)
+    df = df.loc[keep_rows].copy()
 
-    time_col = "poll_at_local" if "poll_at_local" in df.columns else "poll_at_utc"
-    if time_col not in df.columns:
+    # Convert once; date/hour are derived from the local wall clock as compact numeric keys.
+    dt_local = df[time_col].dt.tz_convert("Europe/Paris")
+    df["date"] = dt_local.dt.tz_localize(None).to_numpy().astype("datetime64[D]")
+    df["hour"] = dt_local.dt.hour.astype("int16")
+
+    keep = ["station_code", "date", "hour"] + [m for m in cfg.metrics if m in df.columns]
+    return df[keep]
+
+
+def _group_sums(df: pd.DataFrame, keys: Sequence[str], values: Dict[str, np.ndarray]) -> pd.DataFrame:
+    """
+    Sum each array in values over the groups of keys, one row per group in sorted key order.
+
+    Equivalent to df.groupby(keys, observed=True).sum() (rows with a missing key are
+    dropped), but done as factorize -> one stable argsort of a combined integer key ->
+    np.add.reduceat over the contiguous runs, without building groupby objects.
+    """
+    combined = np.zeros(len(df), dtype=np.int64)
+    valid = np.ones(len(df), dtype=bool)
+    factors = []
+    for k in keys:
+        codes, uniques = pd.factorize(df[k], sort=True)
+        valid &= codes >= 0
+        combined = combined * max(len(uniques), 1) + codes
+        factors.append((k, codes, uniques))
+
+    rows = np.flatnonzero(valid)
+    rows = rows[np.argsort(combined[rows], kind="stable")]
+    sorted_key = combined[rows]
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]]) if len(rows) else rows
+
+    first = rows[starts]
+    out = {k: uniques.take(codes[first]) for k, codes, uniques in factors}
+    for name, arr in values.items():
+        out[name] = np.add.reduceat(arr[rows], starts) if len(rows) else arr[:0]
+    return pd.DataFrame(out)
+
+
+def _aggregate_one(file: Path, cfg: HourlyPanelConfig) -> Optional[pd.DataFrame]:
+    """
+    Load one merged file and reduce it to per-(station, date, hour) sums and counts.
+
+    Means are finished in build_hourly_panel: a service day runs past midnight
+    (until the 02:30 cutoff), so the same local hour can appear in two files.
+    """
+    df = _load_one(file, cfg)
+    if df is None or df.empty:
         return None
 
-    df[time_col] = pd.to_datetime(df[time_col], utc=True, errors="coerce")
-    df = df.dropna(subset=[time_col]).copy()
+    # NaN-skipping sums and non-null counts, as groupby sum/count would give.
+    values = {}
+    for m in cfg.metrics:
+        if m in df.columns:
+            v = df[m].to_numpy(dtype=np.float64, na_value=np.nan)
+            seen = ~np.isnan(v)
+            values[f"{m}__sum"] = np.where(seen, v, 0.0)
+            values[f"{m}__n"] = seen.astype(np.int64)
+    values["obs_count"] = df["station_code"].notna().to_numpy(dtype=np.int64)
+    return _group_sums(df, _GROUP_KEYS, values)
 
-    df["dt_local"] = df[time_col].dt.tz_convert("Europe/Paris")
-    df["date"] = df["dt_local"].dt.date
-    df["hour"] = df["dt_local"].dt.hour
 
-    keep = ["station_code", "date", "hour"] + [m for m in cfg.metrics if m in df.columns]
-    return df[keep].copy()
+def build_hourly_panel(cfg: HourlyPanelConfig) -> Path:
+    files = _merged_files(cfg.merged_dir)
+    aggregate = partial(_aggregate_one, cfg=cfg)
 
+    # Daily files are independent: reduce them in parallel, combine in the parent.
+    if cfg.n_workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=min(cfg.n_workers, len(files))) as ex:
+            reduced = list(ex.map(aggregate, files))
+    else:
+        reduced = [aggregate(f) for f in files]
 
-def build_hourly_panel(cfg: HourlyPanelConfig) -> Path:
-    files = sorted(cfg.merged_dir.glob("merged_*.csv"))
-    chunks: List[pd.DataFrame] = []
-    for f in files:
-        df = _load_one(f, cfg)
-        if df is not None and not df.empty:
-            chunks.append(df)
+    chunks: List[pd.DataFrame] = [df for df in reduced if df is not None and not df.empty]
 
     if not chunks:
         raise RuntimeError(f"No usable files found in {cfg.merged_dir}")
 
-    raw = pd.concat(chunks, ignore_index=True)
-
-    grp = raw.groupby(["station_code", "date", "hour"])
-    agg = {m: "mean" for m in cfg.metrics if m in raw.columns}
-    agg["_obs"] = ("station_code", "count")
+    combined = pd.concat(chunks, ignore_index=True, copy=False)
+    sums = _group_sums(
+        combined,
+        _GROUP_KEYS,
+        {c: combined[c].to_numpy() for c in combined.columns if c not in _GROUP_KEYS},
+    )
 
-    panel = grp.agg(**agg).reset_index().rename(columns={"_obs": "obs_count"})
-    panel = panel[panel["obs_count"] >= cfg.min_polls_per_hour].copy()
+    panel = sums[_GROUP_KEYS].copy()
+    for m in cfg.metrics:
+        if f"{m}__sum" in sums.columns:
+            panel[m] = sums[f"{m}__sum"] / sums[f"{m}__n"].where(sums[f"{m}__n"] > 0)
+    panel["obs_count"] = sums["obs_count"]
+    panel = panel[panel["obs_count"] >= cfg.min_polls_per_hour]
 
     # drop stations with always-zero delay (optional hygiene)
     if "mean_delay_s" in panel.columns:
-        tot = panel.groupby("station_code")["mean_delay_s"].sum()
-        bad = tot[tot == 0].index
-        if len(bad) > 0:
-            panel = panel[~panel["station_code"].isin(bad)].copy()
+        tot = panel.groupby("station_code", observed=True, sort=False)["mean_delay_s"].transform("sum")
+        panel = panel[tot != 0]
 
-    panel = panel.drop(columns=["date"])
-    panel = panel.sort_values(["station_code", "hour"]).copy()
+    if not cfg.keep_date_column:
+        panel = panel.drop(columns=["date"])
+    # sort_values returns a new frame; the row filters above need no copies of their own.
+    panel = panel.sort_values(["station_code", "hour"])
 
     for c in ["mean_delay_s", "temperature_2m", "wind_speed_10m"]:
         if c in panel.columns:
             panel[c] = panel[c].round(2)
 
     cfg.out_csv.parent.mkdir(parents=True, exist_ok=True)
-    panel.to_csv(cfg.out_csv, index=False)
+    if cfg.out_csv.suffix == ".parquet":
+        panel.to_parquet(cfg.out_csv, index=False, compression="zstd")
+    else:
+        panel.to_csv(cfg.out_csv, index=False)
     return cfg.out_csv
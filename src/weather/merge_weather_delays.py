@@ -30,15 +30,41 @@ weather_csv:
 
 from __future__ import annotations
 
+import csv
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Sequence
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.dataset as pads
 
 
 _STOP_ID_RE = re.compile(r":(?:Q|SP):(\d+):")
 _IDFM_RE = re.compile(r"IDFM:(\d+)")
+_LAST_DIGITS_RE = re.compile(r"(\d+)(?!.*\d)")
+
+# Columns the merge actually uses from each side input; everything else is never parsed.
+_STOP_INDEX_COLUMNS = [
+    "quay_code",
+    "stop_id_idfm",
+    "monomodal_stop_id",
+    "monomodal_code",
+    "stop_name",
+    "parent_station",
+    "stop_lat",
+    "stop_lon",
+    "zone_id",
+    "location_type",
+    "station_code",
+]
+_STATIONS_COLUMNS = ["old_station_code", "station_code"]
+# Row key of an append-only rer_raw service-day directory (one Parquet file per poll).
+_RAW_KEY = ["poll_at_utc", "stop_id", "line_code"]
+_WEATHER_COLUMNS = ["station_code", "weather_time_utc", "temperature_2m", "precipitation", "wind_speed_10m"]
 
 
 def _extract_quay_code(stop_id: object) -> Optional[str]:
@@ -63,56 +89,151 @@ def _extract_quay_code(stop_id: object) -> Optional[str]:
         return m.group(1)
 
     # Last resort: take the last numeric token if present
-    m = re.findall(r"\d+", s)
+    m = _LAST_DIGITS_RE.search(s)
     if m:
-        return m[-1]
+        return m.group(1)
 
     return None
 
 
-def _read_csv(path: str | Path) -> pd.DataFrame:
+def _extract_quay_codes(stop_ids: pd.Series) -> pd.Series:
+    """
+    Vectorized equivalent of _extract_quay_code over a whole stop_id column.
+
+    Each pattern is applied with Series.str.extract and earlier patterns take
+    precedence, so the result matches the scalar helper row by row. The fallback
+    patterns only run on the rows still unmatched (usually none: SIRI ids match
+    the first one). One alternation regex would not do: it returns the leftmost
+    match rather than the highest-precedence one.
+
+    A day repeats a few hundred distinct stop_ids over every poll, so the patterns
+    run on the distinct values only and the codes are gathered back per row.
+    """
+    row_codes, uniques = pd.factorize(stop_ids)
+    s = pd.Series(uniques).astype("string")
+    codes = s.str.extract(_STOP_ID_RE, expand=False)
+    for pattern in (_IDFM_RE, _LAST_DIGITS_RE):
+        todo = codes.isna() & s.notna()
+        if not todo.any():
+            break
+        codes[todo] = s[todo].str.extract(pattern, expand=False)
+
+    # Missing stop_ids factorize to -1, which picks the NA appended at the end.
+    values = np.append(codes.to_numpy(dtype=object), pd.NA)
+    return pd.Series(values[row_codes], index=stop_ids.index, dtype="string")
+
+
+def _read_csv(path: str | Path, usecols: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Read a CSV with every column kept as text, using the multithreaded Arrow parser.
+
+    Column types are declared up front from the header: pandas' engine="pyarrow"
+    only casts to str after Arrow has inferred types, which would rewrite ISO
+    timestamps (and strip leading zeros) before the merge sees them.
+
+    usecols restricts the read to those columns, in that order (missing ones are
+    ignored), so side inputs are projected before they are parsed rather than after.
+    """
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(f"File not found: {p}")
-    return pd.read_csv(p, dtype=str)
+
+    # Derived catalogs (stop index, stations) may have an up-to-date Parquet sibling,
+    # and rer_raw days may be stored as Parquet outright (then pq is the path itself,
+    # a single file or an append-only directory of per-poll files).
+    pq = p.with_suffix(".parquet")
+    if pq.exists() and pq.stat().st_mtime >= p.stat().st_mtime:
+        names = pads.dataset(pq).schema.names
+        columns = names if usecols is None else [c for c in usecols if c in names]
+        df = pd.read_parquet(pq, columns=columns)
+        if pq.is_dir() and all(c in columns for c in _RAW_KEY):
+            # A re-sent poll that has not been compacted yet repeats its keys across
+            # files: keep the last row per key, as the polling pipeline's reader does.
+            df = df.drop_duplicates(subset=_RAW_KEY, keep="last", ignore_index=True)
+        return df.astype("string").astype(object).fillna(np.nan)
+
+    with p.open(newline="", encoding="utf-8") as fh:
+        header = next(csv.reader(fh), [])
+    columns = header if usecols is None else [c for c in usecols if c in header]
+
+    table = pacsv.read_csv(
+        p,
+        convert_options=pacsv.ConvertOptions(
+            column_types={c: pa.string() for c in columns},
+            include_columns=columns,
+            strings_can_be_null=True,
+        ),
+    )
+    # One block per column, with Arrow buffers released as each column is converted,
+    # so the table and the frame are never both held in full (no consolidation copy).
+    # Same missing-value representation as pd.read_csv(dtype=str).
+    return table.to_pandas(split_blocks=True, self_destruct=True).fillna(np.nan)
 
 
 def _to_utc(ts: pd.Series) -> pd.Series:
     # utc=True makes tz-naive timestamps interpreted as UTC, and keeps tz-aware in UTC.
-    return pd.to_datetime(ts, errors="coerce", utc=True)
+    # format="ISO8601" keeps parsing on the C fast path and accepts both "T" and " "
+    # separators (raw polls vs weather files); without it pandas infers the format from
+    # the first value and coerces differently-shaped rows to NaT.
+    return pd.to_datetime(ts, errors="coerce", utc=True, format="ISO8601")
 
 
-def _normalize_weather_station_code(weather: pd.DataFrame, stations: pd.DataFrame) -> pd.DataFrame:
+def _legacy_station_mapping(stations: pd.DataFrame) -> Dict[str, str]:
     """
-    Make weather.station_code compatible with our canonical station_code.
-
-    Some legacy weather files store the numeric "old_station_code" as station_code
-    (e.g., "790" for Villepinte). If detected, map it back to the 3-letter station_code.
+    stations.old_station_code -> station_code (empty if the catalog lacks either column).
     """
-    if "station_code" not in weather.columns:
-        raise ValueError("weather_csv must contain a 'station_code' column.")
-
-    w = weather.copy()
-    w["station_code"] = w["station_code"].astype(str).str.strip()
-
     if "old_station_code" not in stations.columns or "station_code" not in stations.columns:
-        return w
+        return {}
 
-    st = stations.copy()
-    st["old_station_code"] = st["old_station_code"].astype(str).str.strip()
-    st["station_code"] = st["station_code"].astype(str).str.strip()
+    st = stations[["old_station_code", "station_code"]].astype(str)
+    st["old_station_code"] = st["old_station_code"].str.strip()
+    st["station_code"] = st["station_code"].str.strip()
 
-    mapping = (
+    return (
         st.loc[st["old_station_code"].notna() & (st["old_station_code"] != ""), ["old_station_code", "station_code"]]
         .drop_duplicates()
         .set_index("old_station_code")["station_code"]
         .to_dict()
     )
 
+
+def _catalog_mtime(path: Path) -> Optional[float]:
+    mtimes = [p.stat().st_mtime for p in (path, path.with_suffix(".parquet")) if p.exists()]
+    return max(mtimes, default=None)
+
+
+@lru_cache(maxsize=4)
+def _cached_legacy_station_mapping(stations_csv: Path, mtime: Optional[float]) -> Dict[str, str]:
+    """
+    Read stations_csv and build the mapping once per catalog version (mtime is part of
+    the cache key), so multi-day merges do not redo it per day. Callers must not modify
+    the returned dict.
+    """
+    return _legacy_station_mapping(_read_csv(stations_csv, usecols=_STATIONS_COLUMNS))
+
+
+def _normalize_weather_station_code(weather: pd.DataFrame, mapping: Dict[str, str]) -> pd.DataFrame:
+    """
+    Make weather.station_code compatible with our canonical station_code.
+
+    Some legacy weather files store the numeric "old_station_code" as station_code
+    (e.g., "790" for Villepinte). If detected, map it back to the 3-letter station_code
+    with mapping (see _legacy_station_mapping).
+    """
+    if "station_code" not in weather.columns:
+        raise ValueError("weather_csv must contain a 'station_code' column.")
+
+    # Shallow copy: station_code is replaced as a whole column below, never written in
+    # place, so the caller's frame is left untouched without duplicating its data.
+    w = weather.copy(deep=False)
+    w["station_code"] = w["station_code"].astype(str).str.strip()
+
     # Heuristic: if most codes look numeric, apply mapping where possible
-    numeric_share = w["station_code"].str.fullmatch(r"\d+").mean()
+    # (isdecimal is the same test as fullmatch(r"\d+") without going through the regex engine)
+    numeric_share = w["station_code"].str.isdecimal().mean()
     if numeric_share >= 0.30:
-        w["station_code"] = w["station_code"].map(lambda x: mapping.get(x, x))
+        mapped = w["station_code"].map(mapping)
+        w["station_code"] = mapped.where(mapped.notna(), w["station_code"])
 
     return w
 
@@ -132,15 +253,18 @@ def merge_daily_raw_with_weather(
 
     Parameters
     ----------
+    out_csv:
+        Optional output path; a ".parquet" suffix writes Parquet (zstd), anything else CSV.
     drop_unmapped_stops:
         If True, drop rows whose stop_id cannot be mapped to station_code.
     max_unmapped_share:
         If share of unmapped rows exceeds this threshold, raise (usually join-key mismatch).
     """
     raw = _read_csv(raw_csv)
-    stop_index = _read_csv(stop_index_csv)
-    stations = _read_csv(stations_csv)
-    weather = _read_csv(weather_csv)
+    stop_index = _read_csv(stop_index_csv, usecols=_STOP_INDEX_COLUMNS)
+    # stations is only used for the legacy code mapping, reused across calls.
+    legacy_codes = _cached_legacy_station_mapping(Path(stations_csv), _catalog_mtime(Path(stations_csv)))
+    weather = _read_csv(weather_csv, usecols=_WEATHER_COLUMNS)
 
     # --- parse timestamps in raw
     if "poll_at_utc" not in raw.columns:
@@ -148,29 +272,12 @@ def merge_daily_raw_with_weather(
     raw["poll_at_utc"] = _to_utc(raw["poll_at_utc"])
 
     # --- build quay_code join key
-    raw["quay_code"] = raw["stop_id"].map(_extract_quay_code).astype(str)
-    raw.loc[raw["quay_code"].isin(["None", "nan"]), "quay_code"] = pd.NA
+    raw["quay_code"] = _extract_quay_codes(raw["stop_id"]).astype(object)
 
     stop_index["quay_code"] = stop_index["quay_code"].astype(str).str.strip()
 
-    # Keep only the columns we want from the stop index to avoid noisy duplicates.
-    stop_keep = [
-        "quay_code",
-        "stop_id_idfm",
-        "monomodal_stop_id",
-        "monomodal_code",
-        "stop_name",
-        "parent_station",
-        "stop_lat",
-        "stop_lon",
-        "zone_id",
-        "location_type",
-        "station_code",
-    ]
-    stop_keep = [c for c in stop_keep if c in stop_index.columns]
-    stop_index_small = stop_index[stop_keep].copy()
-
-    df = raw.merge(stop_index_small, on="quay_code", how="left", validate="m:1")
+    # The stop index was read with only the columns we want, to avoid noisy duplicates.
+    df = raw.merge(stop_index, on="quay_code", how="left", validate="m:1")
 
     # --- unmapped diagnostics
     missing_station = df["station_code"].isna()
@@ -183,35 +290,48 @@ def merge_daily_raw_with_weather(
             "This usually means the stop_id parsing/join key does not match your rer_stop_index.csv."
         )
     if drop_unmapped_stops and missing_share > 0:
-        df = df.loc[~missing_station].copy()
+        df = df.loc[~missing_station]
+
+    # Low-cardinality keys repeated on every poll row: keep them as categoricals.
+    # astype also gives the filtered rows their own frame, so no extra .copy() is needed.
+    cat_cols = ("station_code", "line_code", "monomodal_code", "stop_id_idfm")
+    df = df.astype({c: "category" for c in cat_cols if c in df.columns})
 
     # --- weather parsing and normalization
-    weather = _normalize_weather_station_code(weather, stations)
+    weather = _normalize_weather_station_code(weather, legacy_codes)
 
     if "weather_time_utc" not in weather.columns:
         raise ValueError("weather_csv must contain 'weather_time_utc'.")
 
     weather["weather_time_utc"] = _to_utc(weather["weather_time_utc"])
 
-    # Keep only weather variables needed for analysis (avoid stop_name duplication).
-    weather_keep = ["station_code", "weather_time_utc", "temperature_2m", "precipitation", "wind_speed_10m"]
-    weather_keep = [c for c in weather_keep if c in weather.columns]
-    weather_small = weather[weather_keep].copy()
+    # weather was read with only the variables needed for analysis (avoids stop_name duplication).
 
     # Align to hour
     df["weather_time_utc"] = df["poll_at_utc"].dt.floor("h")
 
+    # One categorical dtype on both sides: the join matches station codes as integer
+    # codes instead of hashing strings, and station_code stays categorical in the result.
+    station_dtype = pd.CategoricalDtype(
+        df["station_code"].cat.categories.union(pd.Index(weather["station_code"].dropna().unique()))
+    )
+    df["station_code"] = df["station_code"].astype(station_dtype)
+    weather["station_code"] = weather["station_code"].astype(station_dtype)
+
     df = df.merge(
-        weather_small,
+        weather,
         on=["station_code", "weather_time_utc"],
         how="left",
         validate="m:1",
     )
 
-    # Optional output
+    # Optional output (Parquet when the path asks for it, CSV otherwise)
     if out_csv is not None:
         out_path = Path(out_csv)
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        df.to_csv(out_path, index=False)
+        if out_path.suffix == ".parquet":
+            df.to_parquet(out_path, index=False, compression="zstd")
+        else:
+            df.to_csv(out_path, index=False)
 
     return df
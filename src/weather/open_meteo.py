@@ -23,9 +23,10 @@ from __future__ import annotations
 import argparse
 import sys
 import time
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence
+from typing import Dict, Iterable, List, Optional, Sequence, Union
 
 import httpx
 import numpy as np
@@ -42,11 +43,38 @@ def _require_columns(df: pd.DataFrame, cols: Sequence[str], ctx: str) -> None:
         raise ValueError(f"{ctx}: missing required columns: {missing}")
 
 
-def _to_float(x) -> float:
-    try:
-        return float(x)
-    except Exception:
-        return float("nan")
+def _hourly_frame(items: Sequence[dict], hourly_vars: Sequence[str]) -> pd.DataFrame:
+    """
+    Open-Meteo location objects -> point + weather_time_utc + requested variables.
+
+    point is the position of the location in items. All locations are parsed as flat
+    columns into one frame (one to_datetime / to_numeric pass), not one frame each.
+    """
+    points: List[np.ndarray] = []
+    times: List[object] = []
+    values: Dict[str, List[object]] = {v: [] for v in hourly_vars}
+    for i, data in enumerate(items):
+        hourly = (data or {}).get("hourly", {}) or {}
+        t = hourly.get("time", []) or []
+        n = len(t)
+        points.append(np.full(n, i))
+        times.extend(t)
+        for v in hourly_vars:
+            vals = hourly.get(v, None)
+            # Values align on the times: missing or short lists are NaN-padded, extras dropped
+            vals = [np.nan] * n if vals is None else list(vals[:n]) + [np.nan] * (n - len(vals))
+            values[v].extend(vals)
+
+    out = pd.DataFrame(
+        {
+            "point": np.concatenate(points) if points else np.empty(0, dtype=int),
+            "weather_time_utc": pd.to_datetime(times, utc=True, errors="coerce", format="ISO8601"),
+            **{v: pd.to_numeric(pd.Series(values[v], dtype=object), errors="coerce").astype(np.float64) for v in hourly_vars},
+        }
+    )
+    if out["weather_time_utc"].isna().any():
+        out = out.dropna(subset=["weather_time_utc"], ignore_index=True)
+    return out
 
 
 @dataclass
@@ -55,20 +83,29 @@ class OpenMeteoClient:
     timeout_s: float = 30.0
     retries: int = 3
     backoff_s: float = 0.75
+    # One pooled connection set shared by every request (and thread) of this client,
+    # so consecutive requests skip the TCP/TLS handshake.
+    _http: httpx.Client = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self._http = httpx.Client(
+            timeout=httpx.Timeout(self.timeout_s),
+            headers={"User-Agent": "idf-rer-delays/0.1 (+github; educational)"},
+        )
 
-    def _get(self, params: dict) -> dict:
-        headers = {"User-Agent": "idf-rer-delays/0.1 (+github; educational)"}
-        timeout = httpx.Timeout(self.timeout_s)
+    def close(self) -> None:
+        self._http.close()
+
+    def _get(self, params: dict) -> Union[dict, List[dict]]:
         last_err: Optional[Exception] = None
 
         for attempt in range(self.retries):
             if attempt > 0:
                 time.sleep(self.backoff_s * (2 ** (attempt - 1)))
             try:
-                with httpx.Client(timeout=timeout, headers=headers) as client:
-                    r = client.get(self.base_url, params=params)
-                    r.raise_for_status()
-                    return r.json()
+                r = self._http.get(self.base_url, params=params)
+                r.raise_for_status()
+                return r.json()
             except Exception as e:
                 last_err = e
 
@@ -107,20 +144,36 @@ class OpenMeteoClient:
             "hourly": ",".join(hourly_vars),
         }
 
-        data = self._get(params)
-        hourly = (data or {}).get("hourly", {}) or {}
-        times = hourly.get("time", []) or []
+        return _hourly_frame([self._get(params)], hourly_vars).drop(columns="point")
 
-        out = pd.DataFrame({"weather_time_utc": pd.to_datetime(times, utc=True, errors="coerce")})
-        for v in hourly_vars:
-            values = hourly.get(v, None)
-            if values is None:
-                out[v] = np.nan
-            else:
-                out[v] = pd.to_numeric(pd.Series(values), errors="coerce")
+    def fetch_hourly_batch(
+        self,
+        lats: Sequence[float],
+        lons: Sequence[float],
+        date: str,
+        hourly_vars: Sequence[str] = DEFAULT_HOURLY_VARS,
+    ) -> pd.DataFrame:
+        """
+        Fetch hourly weather for several points in one request (comma-separated coordinates).
+
+        Returns one frame for all points, shaped as fetch_hourly_for_point's plus a point
+        column: the position of the row's coordinates in lats/lons.
+        """
+        params = {
+            "latitude": ",".join(str(float(x)) for x in lats),
+            "longitude": ",".join(str(float(x)) for x in lons),
+            "timezone": "UTC",
+            "start_date": date,
+            "end_date": date,
+            "hourly": ",".join(hourly_vars),
+        }
 
-        out.dropna(subset=["weather_time_utc"], inplace=True)
-        return out
+        data = self._get(params)
+        # Several locations come back as a list of objects, a single one as the object itself.
+        items = data if isinstance(data, list) else [data]
+        if len(items) != len(lats):
+            raise RuntimeError(f"Open-Meteo returned {len(items)} locations for {len(lats)} requested")
+        return _hourly_frame(items, hourly_vars)
 
 
 def build_daily_station_weather(
@@ -130,6 +183,8 @@ def build_daily_station_weather(
     limit: Optional[int] = None,
     sleep_s: float = 0.0,
     client: Optional[OpenMeteoClient] = None,
+    n_workers: int = 8,
+    points_per_request: int = 50,
 ) -> pd.DataFrame:
     """
     Build an hourly weather panel for all stations for a given date.
@@ -139,49 +194,66 @@ def build_daily_station_weather(
     - stop_lat
     - stop_lon
     - stop_name (optional)
+
+    Stations are fetched points_per_request at a time (one multi-coordinate request each),
+    by n_workers threads (requests are I/O-bound); sleep_s is applied after each request,
+    within its worker.
     """
     _require_columns(stations, ["stop_lat", "stop_lon"], "stations dataframe")
 
+    own_client = client is None
     client = client or OpenMeteoClient()
 
-    df = stations.copy()
-    if limit is not None:
-        df = df.head(int(limit)).copy()
-
-    # Normalize column presence
-    if "station_code" not in df.columns:
-        df["station_code"] = ""
-    if "stop_name" not in df.columns:
-        df["stop_name"] = ""
+    # Only read from stations: no copy needed
+    df = stations if limit is None else stations.iloc[: int(limit)]
 
-    rows: List[pd.DataFrame] = []
-
-    for i, r in df.reset_index(drop=True).iterrows():
-        lat = _to_float(r["stop_lat"])
-        lon = _to_float(r["stop_lon"])
-        if not np.isfinite(lat) or not np.isfinite(lon):
-            continue
-
-        w = client.fetch_hourly_for_point(lat=lat, lon=lon, date=date, hourly_vars=hourly_vars)
-        w.insert(0, "stop_lon", lon)
-        w.insert(0, "stop_lat", lat)
-        w.insert(0, "stop_name", r.get("stop_name", ""))
-        w.insert(0, "station_code", r.get("station_code", ""))
-
-        rows.append(w)
+    # Stations without usable coordinates are skipped
+    lats = pd.to_numeric(df["stop_lat"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    lons = pd.to_numeric(df["stop_lon"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    valid = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+    step = max(1, int(points_per_request))
+    groups = [valid[i : i + step] for i in range(0, len(valid), step)]
 
+    def fetch_group(pos: np.ndarray) -> pd.DataFrame:
+        w = client.fetch_hourly_batch(lats[pos], lons[pos], date=date, hourly_vars=hourly_vars)
         if sleep_s > 0:
             time.sleep(float(sleep_s))
+        return w
 
-        if (i + 1) % 25 == 0:
-            print(f"[open_meteo] fetched {i+1}/{len(df)} stations", file=sys.stderr)
+    # One frame per request; point is mapped back to the station's position in df.
+    frames: List[pd.DataFrame] = []
+    station_pos: List[np.ndarray] = []
+    done = 0
 
-    if not rows:
+    # Requests overlap across workers; map() still yields results in station order.
+    # A client created here is closed even when a request fails.
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, int(n_workers))) as ex:
+            for pos, w in zip(groups, ex.map(fetch_group, groups)):
+                frames.append(w.drop(columns="point"))
+                station_pos.append(pos[w["point"].to_numpy()])
+
+                done += len(pos)
+                print(f"[open_meteo] fetched {done}/{len(valid)} stations", file=sys.stderr)
+    finally:
+        if own_client:
+            client.close()
+
+    if not len(valid):
         return pd.DataFrame(
             columns=["station_code", "stop_name", "stop_lat", "stop_lon", "weather_time_utc", *hourly_vars]
         )
 
-    out = pd.concat(rows, ignore_index=True)
+    # Optional columns default to ""
+    rows = np.concatenate(station_pos)
+    codes = df["station_code"].to_numpy(dtype=object) if "station_code" in df.columns else np.full(len(df), "", dtype=object)
+    names = df["stop_name"].to_numpy(dtype=object) if "stop_name" in df.columns else np.full(len(df), "", dtype=object)
+
+    out = pd.concat(frames, ignore_index=True)
+    out.insert(0, "stop_lon", lons[rows])
+    out.insert(0, "stop_lat", lats[rows])
+    out.insert(0, "stop_name", names[rows])
+    out.insert(0, "station_code", codes[rows])
     # Stable ordering
     out.sort_values(["station_code", "weather_time_utc"], inplace=True)
     return out
@@ -193,18 +265,17 @@ def _read_stations(path: Path) -> pd.DataFrame:
     keep = [c for c in ["station_code", "stop_name", "stop_lat", "stop_lon"] if c in df.columns]
     if not keep:
         raise ValueError(f"{path}: no usable columns found (expected stop_lat/stop_lon at minimum).")
-    df = df[keep].copy()
-    return df
+    return df[keep]
 
 
 def main(argv: Optional[Sequence[str]] = None) -> int:
     ap = argparse.ArgumentParser(description="Fetch daily (hourly) weather for stations using Open-Meteo.")
     ap.add_argument("--stations", required=True, help="Path to stations.csv (must contain stop_lat, stop_lon).")
     ap.add_argument("--date", required=True, help="Date in YYYY-MM-DD (UTC day).")
-    ap.add_argument("--out", required=True, help="Output CSV path.")
+    ap.add_argument("--out", required=True, help="Output path (.csv, or .parquet for a zstd Parquet file).")
     ap.add_argument("--limit", type=int, default=None, help="Limit number of stations (for smoke tests).")
     ap.add_argument("--batch-size", type=int, default=250, help="Write to disk every N stations.")
-    ap.add_argument("--sleep", type=float, default=0.0, help="Sleep between station requests (seconds).")
+    ap.add_argument("--sleep", type=float, default=0.0, help="Sleep after each request (seconds).")
     ap.add_argument(
         "--hourly",
         default=",".join(DEFAULT_HOURLY_VARS),
@@ -213,6 +284,8 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     ap.add_argument("--base-url", default=DEFAULT_BASE_URL, help="Open-Meteo endpoint.")
     ap.add_argument("--timeout", type=float, default=30.0, help="HTTP timeout seconds.")
     ap.add_argument("--retries", type=int, default=3, help="HTTP retries.")
+    ap.add_argument("--workers", type=int, default=8, help="Concurrent requests.")
+    ap.add_argument("--points-per-request", type=int, default=50, help="Stations per multi-coordinate request.")
     args = ap.parse_args(list(argv) if argv is not None else None)
 
     stations_path = Path(args.stations)
@@ -229,15 +302,16 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
     )
 
     # Chunked processing to keep memory low and make progress visible.
-    df = stations.copy()
-    if args.limit is not None:
-        df = df.head(int(args.limit)).copy()
+    df = stations if args.limit is None else stations.iloc[: int(args.limit)]
 
     batch_size = max(1, int(args.batch_size))
     written = False
+    # Parquet cannot be appended to: batches are kept and written once at the end.
+    as_parquet = out_path.suffix == ".parquet"
+    panels: List[pd.DataFrame] = []
 
     for start in range(0, len(df), batch_size):
-        chunk = df.iloc[start : start + batch_size].copy()
+        chunk = df.iloc[start : start + batch_size]
         panel = build_daily_station_weather(
             stations=chunk,
             date=str(args.date),
@@ -245,8 +319,14 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
             limit=None,
             sleep_s=float(args.sleep),
             client=client,
+            n_workers=int(args.workers),
+            points_per_request=int(args.points_per_request),
         )
 
+        if as_parquet:
+            panels.append(panel)
+            continue
+
         mode = "w" if not written else "a"
         header = not written
         panel.to_csv(out_path, index=False, mode=mode, header=header)
@@ -257,6 +337,12 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
             file=sys.stderr,
         )
 
+    client.close()
+
+    if as_parquet and panels:
+        pd.concat(panels, ignore_index=True).to_parquet(out_path, index=False, compression="zstd")
+        print(f"[open_meteo] wrote {len(df)} stations to {out_path}", file=sys.stderr)
+
     return 0
 
 